@@ -0,0 +1,378 @@
+import base64
+import hashlib
+import io
+import json
+import math
+import multiprocessing as mp
+import re
+import sys
+import threading
+import time
+from array import array
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+
+import a43
+
+
+def render(workers: int, **kwargs) -> str:
+    """Digest of a seeded canvas, so a mismatch does not make pytest diff megabytes of SVG"""
+    out: io.StringIO = io.StringIO()
+    a43.SvgCanvas(out, 800, 600, 2500, seed=5, workers=workers, **kwargs)
+    return hashlib.sha256(out.getvalue().encode()).hexdigest()
+
+
+@pytest.fixture
+def summer(monkeypatch):
+    monkeypatch.setattr(a43.PyArtConfig, "theme", "summer")
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_parallel_canvas_is_byte_identical(workers):
+    assert render(workers) == render(1)
+
+
+@pytest.mark.parametrize("method", ["fork", "spawn"])
+def test_parallel_canvas_uses_parent_theme(summer, method):
+    previous: str = mp.get_start_method()
+    mp.set_start_method(method, force=True)
+    try:
+        assert render(2) == render(1)
+    finally:
+        mp.set_start_method(previous, force=True)
+
+
+def test_parallel_canvas_counts_shapes():
+    circles, rects = a43.CircleShape.ccnt, a43.RectangleShape.ccnt
+    render(2)
+    assert a43.CircleShape.ccnt + a43.RectangleShape.ccnt - circles - rects == 2500
+
+
+def test_chunk_larger_than_its_slot_is_rejected():
+    shm = SharedMemory(create=True, size=2048)
+    try:
+        with pytest.raises(ValueError):
+            a43.render_chunk(shm.name, 0, 1024, 800, 600, "autumn", 5, 0, 100, "   ")
+        assert bytes(shm.buf) == bytes(2048)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_running_stat_matches_direct_computation():
+    values = [(k * 37) % 101 / 3 for k in range(3000)]
+    stat = a43.RunningStat(0, 40)
+    for start in range(0, len(values), 700):
+        stat.add_batch(values[start:start + 700])
+    mean = sum(values) / len(values)
+    assert stat.n == len(values)
+    assert stat.mean == pytest.approx(mean)
+    assert stat.m2 / stat.n == pytest.approx(sum((v - mean) ** 2 for v in values) / len(values))
+    assert (stat.vmin, stat.vmax) == (min(values), max(values))
+    assert stat.hist == [sum(1 for v in values if min(int(v / 4), 9) == b) for b in range(10)]
+
+
+def test_gallery_hosts_each_canvas_in_a_template(tmp_path):
+    name = str(tmp_path / "gallery")
+    specs = [a43.CanvasSpec("winter", 300, 200, 40), a43.CanvasSpec("summer", 500, 400, 70)]
+    a43.HtmlDocument(name, "gallery", gallery=specs, stats=True)
+    with open(name + ".html") as f:
+        html = f.read()
+    assert html.count("<template id=") == html.count("</template>") == 2
+    assert html.count('<div class="art"') == 2
+    assert html.count("</svg>") == 2
+    assert html.count("<circle") + html.count("<rect") == 110
+    with open(name + ".stats.json") as f:
+        stats = json.load(f)
+    assert len(stats) == 2
+    assert [sum(s["kinds"].values()) for s in stats] == [40, 70]
+
+
+def test_animated_document_collects_stats(tmp_path):
+    name = str(tmp_path / "anim")
+    a43.HtmlDocument(name, "anim", frames=3, stats=True)
+    with open(name + ".stats.json") as f:
+        stats = json.load(f)
+    assert len(stats) == 1
+    assert sum(stats[0]["kinds"].values()) == stats[0]["fields"]["x"]["n"] > 0
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_reader_streams_batches_in_document_order(tmp_path, monkeypatch, workers):
+    path = str(tmp_path / "shapes.html")
+    with open(path, "w") as f:
+        a43.SvgCanvas(f, 800, 600, 2500, seed=5)
+    expected = a43.read_range(path, 0, a43.os.path.getsize(path))
+    monkeypatch.setattr(a43.ShapeReader, "SPAN", 4096)  # many more ranges than workers
+    batches = list(a43.ShapeReader(path, batch=7, workers=workers))
+    assert [r for batch in batches for r in batch] == expected
+    assert len(expected) == 2500
+    assert {len(batch) for batch in batches[:-1]} == {7}
+
+
+def test_reader_skips_malformed_numbers(tmp_path):
+    path = tmp_path / "shapes.html"
+    path.write_text('<circle cx="1" cy="2" r="3" fill="rgb(4,5,6)" fill-opacity="."/>\n'
+                    '<circle cx="1" cy="2" r="3" fill="rgb(4,5,6)" fill-opacity="1e-05"/>\n'
+                    '<rect x ="7" y = "8" width = "9" height = "10" fill = "rgb(1,2,3)" fill-opacity = "-."/>\n'
+                    '<rect x ="7" y = "8" width = "9" height = "10" fill = "rgb(1,2,3)" fill-opacity = ".25"/>\n')
+    assert [r.op for batch in a43.ShapeReader(str(path)) for r in batch] == [1e-05, 0.25]
+
+
+def test_budget_without_limits_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        a43.BudgetedCanvas(io.StringIO(), 800, 600, a43.Budget(None, None))
+    with pytest.raises(ValueError):
+        a43.HtmlDocument(str(tmp_path / "doc"), "doc", budget=a43.Budget(None, None))
+    assert not (tmp_path / "doc.html").exists()
+
+
+def test_budget_counts_calibration(tmp_path):
+    canvas = a43.BudgetedCanvas(io.StringIO(), 800, 600, a43.Budget(0.05, None))
+    assert canvas.report["seconds"] < 0.05 + 0.02  # one shape and the closing tag past the deadline
+    canvas = a43.BudgetedCanvas(io.StringIO(), 800, 600, a43.Budget(None, 200000))
+    assert canvas.report["bytes"] <= 200000
+    assert canvas.report["planned"] < 1000000
+
+
+@pytest.mark.parametrize("options", [
+    dict(budget=a43.Budget(1.0, None), frames=3),
+    dict(budget=a43.Budget(1.0, None), gallery=[a43.CanvasSpec("winter", 300, 200, 50)]),
+    dict(render="canvas2d", budget=a43.Budget(1.0, None)),
+    dict(render="canvas2d", frames=3),
+    dict(render="canvas2d", gallery=[a43.CanvasSpec("winter", 300, 200, 50)]),
+])
+def test_document_rejects_options_it_would_ignore(tmp_path, options):
+    with pytest.raises(ValueError):
+        a43.HtmlDocument(str(tmp_path / "doc"), "doc", **options)
+    assert not (tmp_path / "doc.html").exists()
+
+
+def test_budget_exhausted_before_calibration():
+    canvas = a43.BudgetedCanvas(io.StringIO(), 800, 600, a43.Budget(0.0, None))
+    assert canvas.report["shapes"] == 0 and canvas.report["stopped"] == "deadline"
+    assert canvas.report["planned"] is None
+    assert canvas.report["time_used"] == float("inf")
+
+
+def test_byte_budget_counts_the_lines_written():
+    out = io.StringIO()
+    canvas = a43.BudgetedCanvas(out, 800, 600, a43.Budget(None, 20000))
+    closing = out.getvalue().splitlines(keepends=True)[-1]
+    assert canvas.report["stopped"] == "bytes"
+    assert canvas.report["bytes"] == len(out.getvalue())
+    assert canvas.report["bytes"] - len(closing) <= 20000 - a43.BudgetedCanvas.RESERVE
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    queue = a43.RenderQueue(str(tmp_path / "queue.db"), lease=0.2)
+    for k in range(2):
+        queue.add(str(tmp_path / f"doc{k}"), f"doc{k}", seed=k)
+    yield queue
+    queue.close()
+
+
+def test_queue_claims_each_job_once(jobs):
+    first, second = jobs.claim("a"), jobs.claim("b")
+    assert first[0] != second[0]
+    assert jobs.claim("c") is None
+
+
+def test_queue_expired_lease_is_taken_over(jobs):
+    job = jobs.claim("a")
+    jobs.claim("a")
+    time.sleep(0.3)
+    assert jobs.claim("b")[0] == job[0]
+    assert not jobs.renew(job[0], "a")
+    jobs.complete(job[0], "a", "late", 1.0)  # the old owner no longer counts
+    assert jobs.counts() == {"running": 2}
+    jobs.complete(job[0], "b", "ok", 1.0)
+    assert jobs.counts() == {"done": 1, "running": 1}
+
+
+def test_queue_renews_lease_while_rendering(jobs, monkeypatch):
+    def slow(file_name, win_title, spec):
+        time.sleep(0.8)
+        return "slow"
+    monkeypatch.setattr(a43.RenderQueue, "render", staticmethod(slow))
+    worker = threading.Thread(target=a43.queue_worker, args=(jobs.path, "a", 0.2))
+    worker.start()
+    time.sleep(0.5)
+    other = a43.RenderQueue(jobs.path, lease=0.2)
+    try:
+        assert other.claim("b")[1].endswith("doc1")  # doc0 is still leased well past its 0.2 s
+    finally:
+        other.close()
+        worker.join()
+    assert jobs.counts() == {"done": 2}
+
+
+def test_queue_resumes_and_removes_orphaned_parts(jobs, tmp_path):
+    dead = jobs.claim("dead")
+    orphan = tmp_path / f"{dead[1]}.part99999.html"
+    orphan.write_text("<html>")
+    time.sleep(0.3)
+    assert jobs.work("b") == 2
+    assert jobs.counts() == {"done": 2}
+    assert not orphan.exists()
+    assert sorted(p.name for p in tmp_path.glob("doc*")) == ["doc0.html", "doc1.html"]
+
+
+def test_queue_rerun_waits_for_a_crashed_lease(jobs):
+    jobs.claim("dead")  # a worker that crashed mid-render, its lease still running
+    start = time.perf_counter()
+    assert jobs.work("b") == 2
+    assert jobs.counts() == {"done": 2}
+    assert time.perf_counter() - start > 0.1  # only once the 0.2 s lease expired
+
+
+def test_queue_gives_up_after_max_attempts(tmp_path):
+    queue = a43.RenderQueue(str(tmp_path / "queue.db"))
+    try:
+        queue.add(str(tmp_path / "bad"), "bad", render="bogus")
+        assert queue.work("a") == 0
+        assert queue.counts() == {"failed": 1}
+        attempts, error = queue.db.execute("SELECT attempts, error FROM jobs").fetchone()
+        assert attempts == a43.RenderQueue.MAX_ATTEMPTS and "ValueError" in error
+    finally:
+        queue.close()
+
+
+
+def test_svg_sink_writes_what_html_document_writes(tmp_path):
+    a43.rd.seed(3)
+    a43.HtmlDocument(str(tmp_path / "doc"), "art")
+    a43.rd.seed(3)
+    width, height = a43.gen_int(a43.Irange(50, 1500)), a43.gen_int(a43.Irange(50, 1500))
+    a43.FanOut(width, height).register(a43.SvgSink(str(tmp_path / "sink"), "art", width, height)).run()
+    doc = (tmp_path / "doc.html").read_text()
+    sink = (tmp_path / "sink.html").read_text()
+    assert sink == doc.replace("</body>", a43.HtmlDocument.TAB + "</svg>\n</body>")  # the sink closes its <svg>
+
+
+def bounds(r):
+    """Centre and radius of the bounding circle samplers place a shape record by"""
+    if r.sha == 0:
+        return r.x, r.y, r.rad
+    return r.x + r.width // 2, r.y + r.height // 2, math.hypot(r.width, r.height) / 2
+
+
+@pytest.fixture
+def sampler(monkeypatch):
+    def use(name):
+        monkeypatch.setitem(a43.PyArtConfig.samplers, a43.PyArtConfig.theme, name)
+    return use
+
+
+def test_poisson_points_keep_minimum_distance():
+    a43.rd.seed(1)
+    poisson = a43.PoissonDiskSampler(800, 600, 500)
+    points = [poisson.place(0) for k in range(500)]
+    assert None not in points
+    assert min(math.dist(p, q) for i, p in enumerate(points) for q in points[:i]) >= poisson.dist
+
+
+def test_stratified_fills_each_cell_once_per_pass(sampler):
+    stratified = a43.StratifiedSampler(410, 410, 100)  # 10 x 10 cells of 40 pixels
+    points = [stratified.place(0) for k in range(200)]
+    cells = [(x - a43.PositionSampler.LOW) // 40 + (y - a43.PositionSampler.LOW) // 40 * 10 for x, y in points]
+    assert sorted(cells[:100]) == sorted(cells[100:]) == list(range(100))
+    sampler("stratified")
+    out = io.StringIO()
+    a43.SvgCanvas(out, 800, 600, 500)
+    assert out.getvalue().count("<circle") + out.getvalue().count("<rect") == 500
+
+
+def test_nonoverlap_skips_shapes_that_do_not_fit(sampler, tmp_path):
+    sampler("nonoverlap")
+    a43.rd.seed(1)
+    path = str(tmp_path / "shapes.html")
+    with open(path, "w") as f:
+        canvas = a43.SvgCanvas(f, 800, 600, 500)
+    shapes = [bounds(r) for r in a43.read_range(path, 0, a43.os.path.getsize(path))]
+    assert len(shapes) == canvas.sampler.accepted > 60  # not just the shapes before the first miss
+    assert all(math.dist(p[:2], q[:2]) >= p[2] + q[2] for i, p in enumerate(shapes) for q in shapes[:i])
+
+
+class FailingSink(a43.ShapeSink):
+    def __init__(self):
+        self.calls = []
+
+    def open(self):
+        self.calls.append("open")
+
+    def write(self, batch):
+        self.calls.append("write")
+        raise RuntimeError("disk full")
+
+    def close(self):
+        self.calls.append("close")
+
+    def abort(self):
+        self.calls.append("abort")
+
+
+def test_fanout_aborts_a_failed_sink_and_feeds_the_others(tmp_path, monkeypatch):
+    monkeypatch.setattr(a43.FanOut, "BATCH", 10)
+    monkeypatch.setattr(a43.FanOut, "DEPTH", 1)  # the failed sink must keep draining or sampling stalls
+    failing, csv_path = FailingSink(), tmp_path / "shapes"
+    pipeline = a43.FanOut(800, 600, 500).register(failing).register(a43.CsvSink(str(csv_path)))
+    with pytest.raises(RuntimeError):
+        pipeline.run()
+    assert failing.calls == ["open", "write", "abort"]
+    assert len((tmp_path / "shapes.csv").read_text().splitlines()) == 501
+
+
+@pytest.mark.parametrize("order", ["zorder", "hilbert"])
+def test_keep_overlaps_keeps_painters_order(tmp_path, order):
+    def shapes(**kwargs):
+        path = tmp_path / "shapes.html"
+        with open(path, "w") as f:
+            a43.SvgCanvas(f, 800, 600, 600, seed=7, **kwargs)
+        return a43.read_range(str(path), 0, path.stat().st_size)
+    sampled = shapes()
+    ordered = shapes(order=order, keep_overlaps=True)
+    assert ordered != sampled and sorted(ordered) == sorted(sampled)
+    position = {r: k for k, r in enumerate(ordered)}
+    assert len(position) == len(ordered)
+    circles = [bounds(r) for r in sampled]
+    for i, p in enumerate(circles):
+        for j, q in enumerate(circles[:i]):
+            if math.dist(p[:2], q[:2]) < p[2] + q[2]:
+                assert position[sampled[j]] < position[sampled[i]]
+
+
+def test_curve_covers_canvases_past_2048_pixels(tmp_path):
+    path = tmp_path / "shapes.html"
+    with open(path, "w") as f:
+        a43.SvgCanvas(f, 4000, 3000, 500, seed=7, order="hilbert")
+    shapes = a43.read_range(str(path), 0, path.stat().st_size)
+    keys = [a43.hilbert_key(min(x, 4000), min(y, 3000), 12) for x, y, r in map(bounds, shapes)]
+    assert keys == sorted(keys)
+
+
+def test_canvas2d_payload_matches_svg_shapes(tmp_path):
+    path = tmp_path / "shapes.html"
+    a43.rd.seed(3)
+    with open(path, "w") as f:
+        a43.SvgCanvas(f, 800, 600, 300)
+    a43.rd.seed(3)
+    out = io.StringIO()
+    a43.Canvas2DCanvas(out, 800, 600, 300)
+    payload, n = re.search(r'\("([A-Za-z0-9+/=]*)",(\d+)\);', out.getvalue()).groups()
+    data, n = base64.b64decode(payload), int(n)
+    geometry, paint = array("h", data[:8 * n]), array("B", data[8 * n:])
+    if sys.byteorder == "big":
+        geometry.byteswap()
+    packed = [(paint[i], geometry[i], geometry[n + i], geometry[2 * n + i], geometry[3 * n + i],
+               paint[n + i], paint[2 * n + i], paint[3 * n + i], paint[4 * n + i]) for i in range(n)]
+    assert packed == [(r.sha, r.x, r.y, r.rad if r.sha == 0 else r.width, r.height, r.red, r.green, r.blue,
+                       round(r.op * 255)) for r in a43.read_range(str(path), 0, path.stat().st_size)]
+
+
+@pytest.mark.parametrize("option", [dict(seed=1), dict(workers=2), dict(order="hilbert"), dict(keep_overlaps=True)])
+def test_canvas2d_rejects_svg_only_options(option):
+    with pytest.raises(TypeError):
+        a43.Canvas2DCanvas(io.StringIO(), 800, 600, 10, **option)